@@ -1,22 +1,23 @@
 from __future__ import annotations
-import os
+import asyncio
 import json
-import tempfile
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Tuple, List, Optional
+from typing import Dict, Any, Awaitable, Callable, Tuple, List, Optional
 
-import nibabel as nib
 from fastapi import FastAPI, UploadFile, File, Query, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 
 # Existing brain helpers
+from core.io_utils import load_nii_fileobj   # in-memory .nii/.nii.gz loader
 from core.lut import load_lut               # returns {int_id: "label name"}
 from core.models import load_model_bundle   # returns {"model","x_cols","classes",...}
-from core.predict import predict            # brain path: uses class_name_map & xai
+from core.predict import predict, warm_up_kernels  # brain path: uses class_name_map & xai
 
 # New heart predictor
-from core.heart_predict import predict_heart_cardio
+from core.heart_predict import load_heart_artifacts, predict_heart_cardio
 
 app = FastAPI(title="EX-AI-AR Backend")
 app.add_middleware(
@@ -31,6 +32,9 @@ BASE_DIR = Path(__file__).resolve().parent
 MODELS_DIR = BASE_DIR / "models"
 STATIC_DIR = BASE_DIR / "static"
 
+# NIfTI decoding + feature extraction + predict are CPU/IO-bound; run them off the event loop
+POOL = ThreadPoolExecutor(max_workers=max(4, os.cpu_count() or 1))
+
 # -----------------------------------------------------------------------------
 # Registry bootstrap: scan models/<organ>/<disease>
 # - model.joblib is required
@@ -69,11 +73,94 @@ def _scan_models(root: Path) -> Dict[Tuple[str, str], Dict[str, Path]]:
 
 PATHS = _scan_models(MODELS_DIR)
 
+# -----------------------------------------------------------------------------
+# Inference handlers: one per (organ, disease), bound to its bundle/LUT at bootstrap
+# -----------------------------------------------------------------------------
+Handler = Callable[[Optional[UploadFile], Optional[UploadFile], Optional[UploadFile], bool], Awaitable[Any]]
+
+async def _has_data(upload: UploadFile) -> bool:
+    # peek one byte, then rewind so the stream can be handed to nibabel
+    head = await upload.read(1)
+    await upload.seek(0)
+    return bool(head)
+
+def _run_brain_infer(bundle: Dict[str, Any], lut: Dict[int, str], fileobj: Any, xai: bool) -> Dict[str, Any]:
+    img = load_nii_fileobj(fileobj)
+    return predict(
+        bundle=bundle,
+        seg_img=img,
+        lut=lut,
+        produce_xai=xai,
+        class_name_map=bundle.get("_class_name_map"),
+    )
+
+def _heart_cardio_handler(bundle: Dict[str, Any]) -> Handler:
+    # HEART: cardiomyopathy (expects masks; LUT not needed)
+    async def handle(file: Optional[UploadFile], ed_file: Optional[UploadFile],
+                     es_file: Optional[UploadFile], xai: bool):
+        # Accept ED/ES separately; allow fallback: single file used as both
+        if ed_file is None and file is None:
+            raise HTTPException(400, "Provide ed_file and es_file or a single 'file' for fallback.")
+
+        try:
+            # hand the spooled upload streams to nibabel; nothing is buffered into bytes
+            if ed_file is not None:
+                if not await _has_data(ed_file):
+                    raise HTTPException(400, "ED mask upload is empty.")
+                if es_file is not None:
+                    if not await _has_data(es_file):
+                        raise HTTPException(400, "ES mask upload is empty.")
+                    ed_src, es_src = ed_file.file, es_file.file
+                else:
+                    # reuse ED mask if ES not provided
+                    ed_src = es_src = ed_file.file
+            else:
+                # fallback single file used for both ED and ES
+                if not await _has_data(file):  # type: ignore[arg-type]
+                    raise HTTPException(400, "Upload is empty.")
+                ed_src = es_src = file.file  # type: ignore[union-attr]
+
+            loop = asyncio.get_running_loop()
+            payload = await loop.run_in_executor(POOL, predict_heart_cardio, bundle, ed_src, es_src, xai)
+            return payload
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"detail": f"Inference error: {e}"})
+    return handle
+
+def _brain_handler(bundle: Dict[str, Any], lut: Optional[Dict[int, str]]) -> Handler:
+    # BRAIN (legacy path): needs LUT + single file
+    async def handle(file: Optional[UploadFile], ed_file: Optional[UploadFile],
+                     es_file: Optional[UploadFile], xai: bool):
+        if file is None:
+            raise HTTPException(400, "Provide 'file' (.nii/.nii.gz) for brain inference.")
+        if lut is None:
+            raise HTTPException(500, "LUT not loaded for this brain model.")
+
+        try:
+            if not await _has_data(file):
+                raise HTTPException(400, "Upload is empty.")
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(POOL, _run_brain_infer, bundle, lut, file.file, xai)
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            return JSONResponse(status_code=500, content={"detail": f"Inference error: {e}"})
+    return handle
+
+def _is_heart_cardio(organ: str, disease: str) -> bool:
+    return organ.lower() == "heart" and disease.lower() == "cardiomyopathy"
+
 # Preload bundles & LUTs in memory
 MODELS: Dict[Tuple[str, str], Dict[str, Any]] = {}
 LUTS: Dict[Tuple[str, str], Dict[int, str]] = {}
+# request router keyed by lower-cased (organ, disease)
+HANDLERS: Dict[Tuple[str, str], Handler] = {}
 
-for key, paths in PATHS.items():
+def _load_one(key: Tuple[str, str], paths: Dict[str, Path]) -> Tuple[Tuple[str, str], Dict[str, Any], Optional[Dict[int, str]]]:
     organ, disease = key
 
     # Load model bundle (works for both brain and heart)
@@ -93,11 +180,17 @@ for key, paths in PATHS.items():
             pass
     bundle["_class_name_map"] = class_map
 
+    # Heart: scaler / x_cols / label map / Booster are loaded once, not per request
+    if _is_heart_cardio(organ, disease):
+        load_heart_artifacts(bundle, str(paths["model_dir"]))
+    else:
+        warm_up_kernels()  # brain: numba compile/cache load happens here, not on the first request
+
     # Load LUT only if present (brain)
+    lut: Optional[Dict[int, str]] = None
     lut_p: Optional[Path] = paths.get("lut")  # type: ignore
     if lut_p and lut_p.exists():
         lut = load_lut(str(lut_p))
-        LUTS[key] = lut
         print(f"[lut] {organ}/{disease}: loaded {len(lut)} labels")
     else:
         print(f"[lut] {organ}/{disease}: no LUT (ok for heart)")
@@ -107,7 +200,20 @@ for key, paths in PATHS.items():
     print(f"[models] {organ}/{disease}: {est.__class__.__name__} "
           f"(predict_proba={has_proba}), keys={list(bundle.keys())}")
 
-    MODELS[key] = bundle
+    return key, bundle, lut
+
+# organ/disease bundles are independent; unpickling + file I/O overlap across threads
+if PATHS:
+    with ThreadPoolExecutor(max_workers=min(8, len(PATHS))) as ex:
+        for key, bundle, lut in ex.map(lambda kp: _load_one(*kp), PATHS.items()):
+            MODELS[key] = bundle
+            if lut is not None:
+                LUTS[key] = lut
+            organ, disease = key
+            HANDLERS[(organ.lower(), disease.lower())] = (
+                _heart_cardio_handler(bundle) if _is_heart_cardio(organ, disease)
+                else _brain_handler(bundle, lut)
+            )
 
 # -----------------------------------------------------------------------------
 # Public endpoints
@@ -133,77 +239,7 @@ async def infer(
     es_file: UploadFile | None = File(default=None),
     xai: bool = Query(False),
 ):
-    key = (organ, disease)
-    if key not in MODELS:
+    handler = HANDLERS.get((organ.lower(), disease.lower()))
+    if handler is None:
         raise HTTPException(status_code=404, detail="Model not found for organ/disease")
-
-    # -------- HEART: cardiomyopathy (expects masks; LUT not needed) --------
-    if organ.lower() == "heart" and disease.lower() == "cardiomyopathy":
-        # Accept ED/ES separately; allow fallback: single file used as both
-        if ed_file is None and file is None:
-            raise HTTPException(400, "Provide ed_file and es_file or a single 'file' for fallback.")
-
-        try:
-            # read uploads safely (never read the same stream twice)
-            if ed_file is not None:
-                ed_bytes = await ed_file.read()
-                if not ed_bytes:
-                    raise HTTPException(400, "ED mask upload is empty.")
-                if es_file is not None:
-                    es_bytes = await es_file.read()
-                    if not es_bytes:
-                        raise HTTPException(400, "ES mask upload is empty.")
-                else:
-                    # reuse ED bytes if ES not provided
-                    es_bytes = ed_bytes
-            else:
-                # fallback single file used for both ED and ES
-                fb = await file.read()  # type: ignore[arg-type]
-                if not fb:
-                    raise HTTPException(400, "Upload is empty.")
-                ed_bytes = fb
-                es_bytes = fb
-
-            model_dir = MODELS[key]["_model_dir"]
-            payload = predict_heart_cardio(model_dir, ed_bytes, es_bytes, want_xai=xai)
-            return payload
-
-        except HTTPException:
-            raise
-        except Exception as e:
-            return JSONResponse(status_code=500, content={"detail": f"Inference error: {e}"})
-
-    # -------- BRAIN (legacy path): needs LUT + single file --------
-    if file is None:
-        raise HTTPException(400, "Provide 'file' (.nii/.nii.gz) for brain inference.")
-    if key not in LUTS:
-        raise HTTPException(500, "LUT not loaded for this brain model.")
-
-    try:
-        contents = await file.read()
-        if not contents:
-            raise HTTPException(400, "Upload is empty.")
-        with tempfile.NamedTemporaryFile(suffix=".nii.gz", delete=False) as tmp:
-            tmp.write(contents)
-            tmp_path = tmp.name
-        try:
-            img = nib.load(tmp_path)
-            bundle = MODELS[key]
-            lut = LUTS[key]
-            result = predict(
-                bundle=bundle,
-                seg_img=img,
-                lut=lut,
-                produce_xai=xai,
-                class_name_map=bundle.get("_class_name_map"),
-            )
-            return result
-        finally:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
-    except HTTPException:
-        raise
-    except Exception as e:
-        return JSONResponse(status_code=500, content={"detail": f"Inference error: {e}"})
+    return await handler(file, ed_file, es_file, xai)
@@ -1,6 +1,7 @@
 # backend/core/aha.py
 from __future__ import annotations
 import numpy as np
+from functools import lru_cache
 from typing import Dict, List
 
 AHA16_NAMES = {
@@ -11,29 +12,45 @@ AHA16_NAMES = {
     13: "Apical Anterior", 14: "Apical Septal", 15: "Apical Inferior", 16: "Apical Lateral"
 }
 
+# ring boundaries along the normalized long axis, and sectors per ring
+_RING_EDGES = np.array([0, 1/3, 2/3, 1.01])
+_RING_SECTORS = (6, 6, 4)  # basal: 6, mid: 6, apical: 4
+
+@lru_cache(maxsize=8)
+def aha16_ids(d:int, h:int, w:int) -> np.ndarray:
+    """
+    Intrinsic AHA segment id per voxel (uint8 [d,h,w], 1..16; 0 = unassigned).
+    Ring comes from normalized long-axis z in [0,1], sector from in-plane angle;
+    both are computed on 1-D/2-D grids and only the final ids are expanded to 3-D.
+    Cached per shape and returned read-only (shared between callers).
+    """
+    z = np.linspace(0, 1, d)
+    yy = np.linspace(-1, 1, h).reshape(h,1)
+    xx = np.linspace(-1, 1, w).reshape(1,w)
+    theta = (np.arctan2(yy, xx) + np.pi) / (2*np.pi)  # [h,w] in [0,1]
+
+    # ring index per slice (same half-open intervals as [lo, hi) masks)
+    ring = np.searchsorted(_RING_EDGES, z, side="right") - 1  # [d]
+
+    # per-ring sector plane with the global segment id already applied
+    planes = np.zeros((len(_RING_SECTORS), h, w), dtype=np.uint8)
+    offset = 0
+    for r, n in enumerate(_RING_SECTORS):
+        edges = np.linspace(0, 1, n+1)
+        sec = np.searchsorted(edges, theta, side="right") - 1  # [h,w], n when theta hits 1.0
+        planes[r] = np.where(sec < n, sec + 1 + offset, 0)
+        offset += n
+    ids = planes[ring]
+    ids.setflags(write=False)
+    return ids
+
 def aha16_bins(d:int, h:int, w:int):
     """
     Create intrinsic AHA bins using normalized long-axis (z in [0,1]) and in-plane angle.
     Returns a dict seg_id -> boolean mask [d,h,w].
     """
-    z = np.linspace(0, 1, d).reshape(d,1,1).repeat(h,1).repeat(w,2)  # shape [d,h,w]
-    yy = np.linspace(-1, 1, h).reshape(1,h,1).repeat(d,0).repeat(w,2)
-    xx = np.linspace(-1, 1, w).reshape(1,1,w).repeat(d,0).repeat(h,1)
-    theta = (np.arctan2(yy, xx) + np.pi) / (2*np.pi)  # [0,1)
-
-    segs: Dict[int, np.ndarray] = {}
-    def ring_mask(lo, hi): return (z>=lo) & (z<hi)
-    def sectors(n):
-        edges = np.linspace(0,1,n+1)
-        return [ (theta>=edges[i]) & (theta<edges[i+1]) for i in range(n) ]
-
-    # basal: 6, mid: 6, apical: 4
-    ridx = 1
-    for rm, n in [(ring_mask(0,1/3),6),(ring_mask(1/3,2/3),6),(ring_mask(2/3,1.01),4)]:
-        for sm in sectors(n):
-            segs[ridx] = (rm & sm)
-            ridx += 1
-    return segs
+    ids = aha16_ids(d, h, w)
+    return {s: ids == s for s in range(1, 17)}
 
 def aha16_names_map() -> Dict[int,str]:
     return dict(AHA16_NAMES)
@@ -1,9 +1,12 @@
 # core/features.py
 from __future__ import annotations
-from typing import Dict, Tuple, List, Optional, Literal
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Tuple, Sequence, Optional, Literal
 
 import numpy as np
-import nibabel as nib
+
+if TYPE_CHECKING:
+    import nibabel as nib
 
 def extract_roi_features(
     seg_img: nib.Nifti1Image,
@@ -21,23 +24,79 @@ def extract_roi_features(
 
     ICV (intracranial volume proxy) is sum of all ROI volumes in mm^3.
     """
-    arr = seg_img.get_fdata().astype(np.int32)
+    # read straight into int32 (no float64 get_fdata copy)
+    arr = np.asarray(seg_img.dataobj, dtype=np.int32)
     vx = seg_img.header.get_zooms()
     vox_mm3 = float(vx[0] * vx[1] * vx[2])
 
-    label_ids: List[int] = sorted(lut.keys())
-    vols = []
-    vol_dict: Dict[str, float] = {}
-    total = 0.0
+    label_ids = np.asarray(sorted(lut.keys()), dtype=np.int64)
+
+    # one pass over the volume: voxel count per label value; the histogram is
+    # bounded by the LUT, not by whatever values the upload happens to contain
+    max_id = int(label_ids.max()) if label_ids.size else 0
+    flat = arr.ravel()
+    counts = np.bincount(flat[(flat >= 0) & (flat <= max_id)], minlength=max_id + 1)
 
-    for lid in label_ids:
-        cnt = int(np.count_nonzero(arr == lid))
-        vol = cnt * vox_mm3
-        vols.append(vol)
-        vol_dict[f"vol_{lid}"] = vol
-        total += vol
+    vols = counts[label_ids].astype(np.float64) * vox_mm3
+    total = float(vols.sum())
 
     if return_type == "dict":
-        return vol_dict, total
+        return {f"vol_{lid}": float(v) for lid, v in zip(label_ids.tolist(), vols.tolist())}, total
     else:
-        return np.asarray(vols, dtype=np.float64), total
+        return vols, total
+
+_INT32_MAX = np.iinfo(np.int32).max
+
+def feature_label_ids(x_cols: Sequence[str]) -> np.ndarray:
+    """
+    Label id for each "vol_<id>" column of `x_cols`, aligned to it
+    (int32, read-only; -1 for columns that are not ROI volumes).
+    """
+    ids = np.full(len(x_cols), -1, dtype=np.int32)
+    for i, col in enumerate(x_cols):
+        # only canonical "vol_<id>" names match (exactly f"vol_{lid}": no sign,
+        # zero padding, spaces or underscores that int() would otherwise accept)
+        s = col[4:]
+        if col.startswith("vol_") and s.isascii() and s.isdigit():
+            lid = int(s)
+            if str(lid) == s and lid <= _INT32_MAX:
+                ids[i] = lid
+    ids.setflags(write=False)
+    return ids
+
+def feature_perm(col_ids: np.ndarray, label_ids: np.ndarray) -> np.ndarray:
+    """
+    For each x_cols position, the index of its label in the LUT-ordered volume
+    vector (`label_ids`, ascending); len(label_ids) where there is none.
+    """
+    label_ids = np.asarray(label_ids, dtype=np.int64)
+    n = label_ids.shape[0]
+    if n == 0:
+        return np.zeros(col_ids.shape[0], dtype=np.int64)
+    pos = np.searchsorted(label_ids, col_ids)
+    hit = (col_ids >= 0) & (label_ids[np.minimum(pos, n - 1)] == col_ids)
+    return np.where(hit, pos, n).astype(np.int64)
+
+def _gather_loop(feats, perm, out):
+    n = feats.shape[0]
+    for i in range(perm.shape[0]):
+        j = perm[i]
+        out[i] = feats[j] if j < n else 0.0
+    return out
+
+@lru_cache(maxsize=1)
+def _gather_kernel():
+    """_gather_loop compiled with numba (imported on first use), or None without numba."""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(cache=True)(_gather_loop)
+
+def gather_features(feats, perm, out):
+    """out[i] = feats[perm[i]], 0.0 where perm[i] == len(feats) (see feature_perm)."""
+    kernel = _gather_kernel()
+    if kernel is not None:
+        return kernel(feats, perm, out)
+    padded = np.append(np.asarray(feats, dtype=np.float64), 0.0)
+    return np.take(padded, perm, out=out)
@@ -1,63 +1,203 @@
 # backend/core/heart_features.py
 from __future__ import annotations
-import tempfile, os
+import hashlib, os, threading
+from collections import OrderedDict
+from functools import lru_cache
 from typing import Dict, Tuple
 import numpy as np
-import nibabel as nib
 
-def _load_mask_from_bytes(b: bytes) -> np.ndarray:
-    """Robust load for Windows: write to temp, then nib.load."""
-    with tempfile.NamedTemporaryFile(suffix=".nii.gz", delete=False) as tmp:
-        tmp.write(b)
-        path = tmp.name
-    try:
-        img = nib.load(path)
-        arr = img.get_fdata().astype(np.int16)
-    finally:
-        try: os.remove(path)
-        except Exception: pass
-    return arr
+from .aha import aha16_ids
+from .io_utils import load_nii_bytes, load_nii_fileobj
+
+# "edt" (default; what the heart model was trained on) or "erosion" (taxicab
+# erosion-count proxy, much cheaper, but shifts the thickness features)
+THICKNESS_MODE = os.environ.get("HEART_THICKNESS", "edt").strip().lower()
+
+def _load_mask(src) -> np.ndarray:
+    """Load a .nii/.nii.gz mask in memory from bytes or a binary file object (e.g. an upload stream)."""
+    img = load_nii_bytes(src) if isinstance(src, (bytes, bytearray)) else load_nii_fileobj(src)
+    return np.asarray(img.dataobj, dtype=np.int16)
 
 def _volumes_mm3(mask: np.ndarray, spacing=(1.5,1.5,2.0)) -> tuple[float,float,float]:
     vx = float(spacing[0]*spacing[1]*spacing[2])
-    v_lv = float((mask==1).sum()) * vx
-    v_rv = float((mask==2).sum()) * vx
-    v_myo= float((mask==3).sum()) * vx
-    return v_lv, v_rv, v_myo
+    # one counting pass instead of three boolean masks; negative labels are
+    # viewed as large unsigned values so they land past bin 3 and are ignored
+    flat = mask.ravel(order="K")
+    if flat.dtype.kind == "i":
+        flat = flat.view(f"u{flat.dtype.itemsize}")
+    c = np.bincount(flat, minlength=4)
+    return float(c[1]) * vx, float(c[2]) * vx, float(c[3]) * vx
 
-def _wall_thickness(mask: np.ndarray) -> np.ndarray:
-    """Proxy thickness via EDT inside myocardium (label 3)."""
+def _myo_box(*masks: np.ndarray):
+    """Union bounding box of myocardium (label 3) over `masks`, +1 voxel margin; None if empty."""
+    myo_any = np.zeros(masks[0].shape, dtype=bool)
+    for m in masks:
+        myo_any |= (m==3)
+    box = []
+    for ax in range(myo_any.ndim):
+        nz = np.nonzero(myo_any.any(axis=tuple(a for a in range(myo_any.ndim) if a != ax)))[0]
+        if nz.size == 0:
+            return None
+        box.append(slice(max(int(nz[0])-1, 0), int(nz[-1])+2))
+    return tuple(box)
+
+def _edt(myo: np.ndarray, sampling=None) -> np.ndarray:
+    """
+    EDT of a boolean volume: `edt` package when installed, else scipy.
+    Single-threaded: callers already run concurrently on app.POOL threads.
+    """
     try:
+        import edt
+    except ImportError:
+        edt = None
+    if edt is None or myo.all():  # edt returns inf when there is no background at all
         from scipy.ndimage import distance_transform_edt
-        myo = (mask==3).astype(np.uint8)
-        return distance_transform_edt(myo)
+        return distance_transform_edt(myo, sampling=sampling)
+    d = edt.edt(np.ascontiguousarray(myo, dtype=np.uint8),
+                anisotropy=tuple(sampling) if sampling is not None else (1.0,)*myo.ndim,
+                black_border=False, parallel=1).astype(float)
+    if sampling is None:
+        # voxel-unit distances are sqrt(integer); undo edt's float32 rounding
+        d = np.sqrt(np.rint(d*d))
+    return d
+
+def _erode_count(mask, out):
+    """
+    out[v] = number of 6-connected erosions voxel v survives + 1, i.e. its
+    taxicab distance to background. Voxels outside the array count as
+    foreground (same border rule as the EDT path).
+    """
+    d, h, w = mask.shape
+    cur = mask.copy()
+    nxt = np.zeros_like(cur)
+    layer = 0
+    while True:
+        layer += 1
+        n_alive = 0
+        for z in range(d):
+            for y in range(h):
+                for x in range(w):
+                    if not cur[z, y, x]:
+                        nxt[z, y, x] = 0
+                        continue
+                    out[z, y, x] = layer
+                    keep = ((z == 0 or cur[z-1, y, x]) and (z == d-1 or cur[z+1, y, x]) and
+                            (y == 0 or cur[z, y-1, x]) and (y == h-1 or cur[z, y+1, x]) and
+                            (x == 0 or cur[z, y, x-1]) and (x == w-1 or cur[z, y, x+1]))
+                    nxt[z, y, x] = keep
+                    n_alive += keep
+        if n_alive == 0 or n_alive == cur.sum():  # emptied, or nothing left to erode
+            break
+        cur, nxt = nxt, cur
+    return out
+
+@lru_cache(maxsize=1)
+def _erode_kernel():
+    """
+    _erode_count compiled with numba, or None without numba. numba is imported
+    here, on the first erosion-mode call, so the default EDT mode never pays for it.
+    Serial on purpose: calls already run concurrently on app.POOL threads, and
+    numba's default parallel backend is not safe to enter from several threads.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(cache=True)(_erode_count)
+
+def _erosion_thickness(myo: np.ndarray) -> np.ndarray:
+    """Erosion-count thickness of a boolean volume (numba kernel, else scipy's taxicab CDT)."""
+    kernel = _erode_kernel()
+    if kernel is not None:
+        return kernel(np.ascontiguousarray(myo, dtype=np.uint8),
+                      np.zeros(myo.shape, dtype=np.int32)).astype(float)
+    from scipy.ndimage import distance_transform_cdt
+    return distance_transform_cdt(myo, metric="taxicab").astype(float)
+
+def _wall_thickness_pair(ed: np.ndarray, es: np.ndarray, sampling=None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Proxy thickness via EDT inside myocardium (label 3), for ED and ES together.
+    EDT runs only on the shared myocardium bounding box plus a 1-voxel background
+    margin, which gives the same distances as the full volume.
+    `sampling` (per-axis spacing) returns mm; default keeps voxel units,
+    matching the thickness features the heart model expects.
+    HEART_THICKNESS=erosion swaps the EDT for the erosion-count proxy (voxel units).
+    """
+    out_ed = np.zeros(ed.shape, dtype=float)
+    out_es = np.zeros(es.shape, dtype=float)
+    try:
+        box = _myo_box(ed, es)
+        if box is None:
+            return out_ed, out_es
+        if THICKNESS_MODE == "erosion":
+            out_ed[box] = _erosion_thickness(ed[box]==3)
+            out_es[box] = _erosion_thickness(es[box]==3)
+        else:
+            out_ed[box] = _edt(ed[box]==3, sampling)
+            out_es[box] = _edt(es[box]==3, sampling)
+        return out_ed, out_es
     except Exception:
         # Fallback: zero thickness (keeps pipeline running)
-        return np.zeros_like(mask, dtype=float)
-
-def _aha16_bins(d:int,h:int,w:int) -> dict[int, np.ndarray]:
-    z = np.linspace(0,1,d).reshape(d,1,1)
-    z = np.broadcast_to(z,(d,h,w))
-    yy = np.linspace(-1,1,h).reshape(1,h,1)
-    yy = np.broadcast_to(yy,(d,h,w))
-    xx = np.linspace(-1,1,w).reshape(1,1,w)
-    xx = np.broadcast_to(xx,(d,h,w))
-    theta = (np.arctan2(yy, xx) + np.pi) / (2*np.pi)  # [0,1)
-    segs: dict[int,np.ndarray] = {}
-    def ring(lo,hi): return (z>=lo)&(z<hi)
-    def sectors(n):
-        edges = np.linspace(0,1,n+1)
-        return [ (theta>=edges[i]) & (theta<edges[i+1]) for i in range(n) ]
-    sid=1
-    for rm, n in [(ring(0,1/3),6),(ring(1/3,2/3),6),(ring(2/3,1.01),4)]:
-        for sm in sectors(n):
-            segs[sid] = rm & sm
-            sid += 1
-    return segs
-
-def extract_features_from_pair(ed_bytes: bytes, es_bytes: bytes, spacing=(1.5,1.5,2.0)) -> tuple[dict[str,float], dict[int,float]]:
-    ed = _load_mask_from_bytes(ed_bytes)
-    es = _load_mask_from_bytes(es_bytes)
+        return np.zeros(ed.shape, dtype=float), np.zeros(es.shape, dtype=float)
+
+_SEG_IDS = np.arange(1,17)
+
+def _median_fast(v: np.ndarray) -> float:
+    """Same value as np.median, via an O(n) partition instead of a full sort."""
+    n = v.size
+    if n == 0:
+        return 0.0
+    k = n // 2
+    if n % 2:
+        return float(np.partition(v, k)[k])
+    p = np.partition(v, (k-1, k))
+    return 0.5 * (float(p[k-1]) + float(p[k]))
+
+def _segment_medians(values: np.ndarray, seg_ids: np.ndarray) -> np.ndarray:
+    """Median of `values` per AHA segment 1..16 in one pass (0.0 where a segment is empty)."""
+    from scipy.ndimage import labeled_comprehension
+    return labeled_comprehension(values, seg_ids, _SEG_IDS, _median_fast, float, 0.0)
+
+# (ED digest, ES digest, spacing) -> (feat, seg_scores); re-uploads of the same masks skip EDT + features
+_FEATURE_CACHE: "OrderedDict[tuple, tuple[dict[str,float], dict[int,float]]]" = OrderedDict()
+_FEATURE_CACHE_MAX = 64
+_FEATURE_CACHE_LOCK = threading.Lock()
+
+def _digest(src) -> bytes:
+    """Content hash of mask bytes or a seekable binary file object (position is restored)."""
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(src, (bytes, bytearray)):
+        h.update(src)
+    else:
+        pos = src.tell()
+        for chunk in iter(lambda: src.read(1 << 20), b""):
+            h.update(chunk)
+        src.seek(pos)
+    return h.digest()
+
+def extract_features_from_pair(ed_src, es_src, spacing=(1.5,1.5,2.0)) -> tuple[dict[str,float], dict[int,float]]:
+    """
+    ed_src / es_src: mask bytes or binary file objects; pass the same object twice to reuse one mask.
+    Results are memoized by mask content (LRU, _FEATURE_CACHE_MAX entries).
+    """
+    ed_h = _digest(ed_src)
+    key = (ed_h, ed_h if es_src is ed_src else _digest(es_src), tuple(spacing))
+    with _FEATURE_CACHE_LOCK:
+        hit = _FEATURE_CACHE.get(key)
+        if hit is not None:
+            _FEATURE_CACHE.move_to_end(key)
+    if hit is None:
+        hit = _extract_features(ed_src, es_src, spacing)
+        with _FEATURE_CACHE_LOCK:
+            _FEATURE_CACHE[key] = hit
+            while len(_FEATURE_CACHE) > _FEATURE_CACHE_MAX:
+                _FEATURE_CACHE.popitem(last=False)
+    feat, seg_scores = hit
+    return dict(feat), dict(seg_scores)  # callers get their own copies
+
+def _extract_features(ed_src, es_src, spacing) -> tuple[dict[str,float], dict[int,float]]:
+    ed = _load_mask(ed_src)
+    es = ed if es_src is ed_src else _load_mask(es_src)
 
     lv_ed, rv_ed, my_ed = _volumes_mm3(ed, spacing)
     lv_es, rv_es, my_es = _volumes_mm3(es, spacing)
@@ -66,11 +206,20 @@ def extract_features_from_pair(ed_bytes: bytes, es_bytes: bytes, spacing=(1.5,1.
     # myocardium volume (mL) * density ~1.05 g/mL
     lvmass_g = (my_ed/1000.0) * 1.05
 
-    # AHA16 thickness stats
+    # AHA16 thickness stats, computed on the myocardium box only: thickness
+    # stays float64 (the model's features), but never at full-volume size
     d,h,w = ed.shape
-    bins = _aha16_bins(d,h,w)
-    thk_ed = _wall_thickness(ed)
-    thk_es = _wall_thickness(es)
+    box = _myo_box(ed, es)
+    if box is None:
+        meds_ed = meds_es = np.zeros(16)
+    else:
+        ed_b, es_b, aha_b = ed[box], es[box], aha16_ids(d,h,w)[box]
+        thk_ed, thk_es = _wall_thickness_pair(ed_b, es_b)
+
+        # per-segment medians over myocardium voxels (0.0 for empty segments)
+        myo_ed, myo_es = (ed_b==3), (es_b==3)
+        meds_ed = _segment_medians(thk_ed[myo_ed], aha_b[myo_ed])
+        meds_es = _segment_medians(thk_es[myo_es], aha_b[myo_es])
 
     feat: dict[str,float] = {
         "LVEDV": lv_ed/1000.0, "LVESV": lv_es/1000.0, "LVEF": lvef,
@@ -80,18 +229,12 @@ def extract_features_from_pair(ed_bytes: bytes, es_bytes: bytes, spacing=(1.5,1.
     seg_scores: dict[int,float] = {}
 
     # within-case robust scaling for segment scores
-    edvals, dvals = [], []
-    for s, m in bins.items():
-        v_ed = thk_ed[m & (ed==3)]
-        v_es = thk_es[m & (es==3)]
-        med_ed = float(np.median(v_ed)) if v_ed.size else 0.0
-        med_es = float(np.median(v_es)) if v_es.size else 0.0
-        feat[f"SEG{s}_thkED"] = med_ed
-        feat[f"SEG{s}_thkES"] = med_es
-        feat[f"SEG{s}_dThk"]  = med_es - med_ed
-        edvals.append(med_ed); dvals.append(med_es - med_ed)
-
-    edvals = np.asarray(edvals); dvals = np.asarray(dvals)
+    edvals, dvals = meds_ed, meds_es - meds_ed
+    for s in range(1,17):
+        feat[f"SEG{s}_thkED"] = float(edvals[s-1])
+        feat[f"SEG{s}_thkES"] = float(meds_es[s-1])
+        feat[f"SEG{s}_dThk"]  = float(dvals[s-1])
+
     med_ed, iqr_ed = np.median(edvals), (np.percentile(edvals,75)-np.percentile(edvals,25)+1e-6)
     med_d,  iqr_d  = np.median(dvals),  (np.percentile(dvals,75)-np.percentile(dvals,25)+1e-6)
     sigmoid = lambda z: 1/(1+np.exp(-z))
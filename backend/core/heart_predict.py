@@ -1,21 +1,27 @@
 # backend/core/heart_predict.py
 from __future__ import annotations
 import os, json
-from typing import Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, Sequence
 import numpy as np
 import joblib
-import xgboost as xgb
 
+if TYPE_CHECKING:  # xgboost is imported on first use (or by unpickling the model)
+    import xgboost as xgb
+
+from .features import feature_label_ids
 from .heart_features import extract_features_from_pair
 
 def _load_json(path:str) -> Any:
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
-def _align_features(feat:Dict[str,float], x_cols:List[str]) -> np.ndarray:
-    x = np.zeros((len(x_cols),), dtype=float)
-    for i, c in enumerate(x_cols):
-        x[i] = float(feat.get(c, 0.0))
+def _align_features(feat:Dict[str,float], col_index:Dict[str,int], n_cols:int) -> np.ndarray:
+    # col_index: x_cols name -> position, built once in load_heart_artifacts
+    x = np.zeros((n_cols,), dtype=float)
+    for k, v in feat.items():
+        j = col_index.get(k)
+        if j is not None:
+            x[j] = v
     return x
 
 def _compat_patch_xgb(clf: Any) -> Any:
@@ -55,19 +61,21 @@ def _booster_from_model(clf: Any):
     bst = getattr(clf, "_Booster", None)
     return bst
 
-def _proba_from_booster(booster: xgb.Booster, X: np.ndarray) -> np.ndarray:
+def _proba_from_booster(booster: xgb.Booster, X: np.ndarray, iteration_range=(0, 0)) -> np.ndarray:
     """
     Get probabilities from raw Booster, robust across versions.
+    iteration_range mirrors XGBClassifier (best_iteration when early-stopped).
     """
     if booster is None:
         raise RuntimeError("No Booster available in XGB model.")
     try:
-        # fastest (newer xgboost)
-        pred = booster.inplace_predict(X, validate_features=False)
+        # fastest (newer xgboost): no DMatrix, no feature-name validation
+        pred = booster.inplace_predict(X, iteration_range=iteration_range, validate_features=False)
     except Exception:
         # fallback (older)
+        import xgboost as xgb
         dm = xgb.DMatrix(X, missing=np.nan)
-        pred = booster.predict(dm, output_margin=False)
+        pred = booster.predict(dm, output_margin=False, iteration_range=iteration_range)
 
     pred = np.asarray(pred)
     if pred.ndim == 1:
@@ -75,26 +83,46 @@ def _proba_from_booster(booster: xgb.Booster, X: np.ndarray) -> np.ndarray:
         pred = np.c_[1.0 - pred, pred]
     return pred
 
-def predict_heart_cardio(model_dir: str, ed_mask_bytes: bytes, es_mask_bytes: bytes, want_xai: bool) -> Dict[str, Any]:
-    # Load artifacts
-    clf = joblib.load(os.path.join(model_dir, "model.joblib"))
-    clf = _compat_patch_xgb(clf)
+def load_heart_artifacts(bundle: Dict[str, Any], model_dir: str) -> Dict[str, Any]:
+    """
+    Load the heart side-artifacts once and attach them to the model bundle:
+    scaler, x_cols (+ name -> index map), label map ("classes") and the raw Booster.
+    x_cols / classes are stored as tuples: the bundle is shared by every request.
+    """
+    clf = _compat_patch_xgb(bundle["model"])
+    bundle["model"] = clf
+    bundle["scaler"] = joblib.load(os.path.join(model_dir, "scaler.joblib"))
+    bundle["x_cols"] = tuple(str(c) for c in _load_json(os.path.join(model_dir, "x_cols.json")))
+    bundle["x_cols_label_ids"] = feature_label_ids(bundle["x_cols"])  # keep in step with x_cols
+    bundle["_col_index"] = {c: i for i, c in enumerate(bundle["x_cols"])}
+    bundle["classes"] = tuple(str(c) for c in _load_json(os.path.join(model_dir, "xgb_label_map.json"))["classes"])
+    bundle["_booster"] = _booster_from_model(clf)
+    try:
+        bundle["_iteration_range"] = (0, int(clf.best_iteration) + 1)
+    except Exception:
+        bundle["_iteration_range"] = (0, 0)  # all trees
+    return bundle
 
-    scaler = joblib.load(os.path.join(model_dir, "scaler.joblib"))
-    x_cols = _load_json(os.path.join(model_dir, "x_cols.json"))
-    label_map = _load_json(os.path.join(model_dir, "xgb_label_map.json"))["classes"]
+def predict_heart_cardio(bundle: Dict[str, Any], ed_mask: Any, es_mask: Any, want_xai: bool) -> Dict[str, Any]:
+    """
+    bundle: model bundle prepared by load_heart_artifacts.
+    ed_mask / es_mask: .nii/.nii.gz bytes or binary file objects.
+    """
+    clf = bundle["model"]
+    scaler = bundle["scaler"]
+    x_cols: Sequence[str] = bundle["x_cols"]
+    label_map: Sequence[str] = bundle["classes"]
 
     # Features (ED/ES masks → volumes/EF/segment thicknesses + AHA16 scores)
-    feat, seg_scores = extract_features_from_pair(ed_mask_bytes, es_mask_bytes)
-    X = _align_features(feat, x_cols).reshape(1, -1)
+    feat, seg_scores = extract_features_from_pair(ed_mask, es_mask)
+    X = _align_features(feat, bundle["_col_index"], len(x_cols)).reshape(1, -1)
     Xs = scaler.transform(X)
 
-    # Predict probabilities robustly
+    # Predict probabilities: cached Booster first (float32 is XGBoost's native input), wrapper as fallback
     try:
-        proba = clf.predict_proba(Xs)[0]
+        proba = _proba_from_booster(bundle["_booster"], Xs.astype(np.float32), bundle["_iteration_range"])[0]
     except Exception:
-        bst = _booster_from_model(clf)
-        proba = _proba_from_booster(bst, Xs)[0]
+        proba = clf.predict_proba(Xs)[0]
 
     # Normalize to label_map length (defensive)
     proba = np.asarray(proba, dtype=float)
@@ -120,7 +148,7 @@ def predict_heart_cardio(model_dir: str, ed_mask_bytes: bytes, es_mask_bytes: by
     xai = None
     if want_xai:
         try:
-            bst = _booster_from_model(clf)
+            bst = bundle["_booster"]
             if bst is not None:
                 gain = bst.get_score(importance_type="gain")
                 importances = [float(gain.get(f"f{i}", 0.0)) for i in range(len(x_cols))]
@@ -144,7 +172,7 @@ def predict_heart_cardio(model_dir: str, ed_mask_bytes: bytes, es_mask_bytes: by
     return {
         "prediction": pred_label,
         "proba": proba_map,
-        "used_features": x_cols,
+        "used_features": list(x_cols),
         "segment_scores": {str(k): float(v) for k, v in seg_scores.items()},
         "xai": xai,
     }
@@ -1,14 +1,35 @@
-import os, tempfile
-import nibabel as nib
+import gzip, io, struct
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+def _nifti_class(head: bytes):
+    """Nifti1Image / Nifti2Image from the sizeof_hdr field (either byte order); None if not NIfTI."""
+    import nibabel as nib
+    if len(head) < 4:
+        return None
+    for order in "<>":
+        n = struct.unpack(order + "i", head[:4])[0]
+        if n == 348:
+            return nib.Nifti1Image
+        if n == 540:
+            return nib.Nifti2Image
+    return None
+
+def load_nii_fileobj(fileobj):
+    # nibabel reads header + data from the file object directly; no temp file.
+    # Works for plain .nii and .nii.gz (sniffed by gzip magic, not by name),
+    # NIfTI-1 or NIfTI-2 (sniffed from sizeof_hdr, as nib.load does).
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    if head == _GZIP_MAGIC:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    klass = _nifti_class(fileobj.read(4))
+    fileobj.seek(0)
+    import nibabel as nib  # deferred: only paid when an upload is decoded
+    if klass is None:
+        raise nib.filebasedimages.ImageFileError("not a single-file NIfTI-1/NIfTI-2 image")
+    fh = nib.FileHolder(fileobj=fileobj)
+    return klass.from_file_map({"header": fh, "image": fh})
 
 def load_nii_bytes(data: bytes):
-    # nibabel prefers a real file for gz; write to temp safely
-    with tempfile.NamedTemporaryFile(suffix=".nii.gz", delete=False) as f:
-        f.write(data)
-        tmp = f.name
-    img = nib.load(tmp)
-    try:
-        os.remove(tmp)
-    except Exception:
-        pass
-    return img
+    return load_nii_fileobj(io.BytesIO(data))
@@ -1,22 +1,36 @@
-import pandas as pd
+import csv, os
+from functools import lru_cache
 from typing import Dict, List
 
+def _dict_reader(f) -> csv.DictReader:
+    reader = csv.DictReader(f)
+    reader.fieldnames = [c.strip().lower() for c in (reader.fieldnames or [])]
+    return reader
+
+# parsed files are memoized by (path, mtime): editing a CSV invalidates its entry,
+# and the public readers hand out copies so callers cannot mutate the cache
+@lru_cache(maxsize=8)
+def _read_lut_csv(path: str, mtime: float) -> Dict[int, str]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = _dict_reader(f)
+        # Expect label_id,label_name
+        assert "label_id" in reader.fieldnames and "label_name" in reader.fieldnames, "lut.csv must have label_id,label_name"
+        return {int(r["label_id"]): r["label_name"] or "" for r in reader}
+
+@lru_cache(maxsize=8)
+def _read_lut_to_glb_csv(path: str, mtime: float) -> Dict[int, List[str]]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = _dict_reader(f)
+        assert "label_id" in reader.fieldnames and "glb_node" in reader.fieldnames, "mapping_lut_to_glb.csv must have label_id, glb_node"
+        out: Dict[int, List[str]] = {}
+        for r in reader:
+            node = (r["glb_node"] or "").strip()
+            if node:
+                out.setdefault(int(r["label_id"]), []).append(node)
+        return out
+
 def read_lut_csv(path: str) -> Dict[int, str]:
-    df = pd.read_csv(path)
-    df.columns = [c.strip().lower() for c in df.columns]
-    # Expect label_id,label_name
-    assert "label_id" in df.columns and "label_name" in df.columns, "lut.csv must have label_id,label_name"
-    return {int(r["label_id"]): str(r["label_name"]) for _, r in df.iterrows()}
+    return dict(_read_lut_csv(path, os.path.getmtime(path)))
 
 def read_lut_to_glb_csv(path: str) -> Dict[int, List[str]]:
-    df = pd.read_csv(path)
-    cols = [c.strip().lower() for c in df.columns]
-    df.columns = cols
-    assert "label_id" in df.columns and "glb_node" in df.columns, "mapping_lut_to_glb.csv must have label_id, glb_node"
-    out: Dict[int, List[str]] = {}
-    for _, r in df.iterrows():
-        lid = int(r["label_id"])
-        node = str(r["glb_node"]).strip()
-        if node:
-            out.setdefault(lid, []).append(node)
-    return out
+    return {k: list(v) for k, v in _read_lut_to_glb_csv(path, os.path.getmtime(path)).items()}
@@ -1,4 +1,6 @@
 # backend/core/model_io.py
+import os
+from functools import lru_cache
 from typing import Any, Dict, Optional, Tuple
 import joblib
 
@@ -41,7 +43,12 @@ def unwrap_estimator(obj: Any) -> Tuple[Any, Optional[Dict[str, Any]]]:
         "Expected an object with .predict, or a dict/tuple containing one."
     )
 
-def load_joblib_then_unwrap(path: str):
-    """Load any joblib artifact and return (estimator, meta_dict_or_None)."""
+@lru_cache(maxsize=8)
+def _load_unwrapped(path: str, mtime: float) -> Tuple[Any, Optional[Dict[str, Any]]]:
     obj = joblib.load(path, mmap_mode="r")
     return unwrap_estimator(obj)
+
+def load_joblib_then_unwrap(path: str):
+    """Load any joblib artifact and return (estimator, meta_dict_or_None); memoized by (path, mtime)."""
+    est, meta = _load_unwrapped(path, os.path.getmtime(path))
+    return est, (dict(meta) if meta is not None else None)
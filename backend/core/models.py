@@ -1,8 +1,13 @@
 # core/models.py
 from __future__ import annotations
+import warnings
+from functools import lru_cache
 from typing import Any, Dict
 from pathlib import Path
 import joblib
+import numpy as np
+
+from .features import feature_label_ids
 
 def load_model_bundle(path: str) -> Dict[str, Any]:
     """
@@ -15,20 +20,52 @@ def load_model_bundle(path: str) -> Dict[str, Any]:
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"model bundle not found: {p}")
+    # shallow copy: callers attach their own keys (scaler, maps, ...) to the bundle
+    return dict(_load_model_bundle(str(p), p.stat().st_mtime))
 
-    obj = joblib.load(p)
+@lru_cache(maxsize=8)
+def _load_model_bundle(path: str, mtime: float) -> Dict[str, Any]:
+    """Unpickle + normalize once per (path, mtime); see load_model_bundle."""
+    # numpy arrays stored uncompressed in the pickle are memory-mapped read-only,
+    # so worker processes share one page-cache copy of the model weights
+    obj = joblib.load(path, mmap_mode="r")
     if isinstance(obj, dict) and "model" in obj:
-        # Normalize x_cols to strings, classes to list of str
+        _warm_up(obj["model"])
+        if obj.get("_normalized"):
+            # bundle was saved after going through this function; nothing to redo
+            # (older saves kept x_cols as a list)
+            if isinstance(obj.get("x_cols"), list):
+                obj["x_cols"] = tuple(obj["x_cols"])
+            return obj
+        # Normalize x_cols / classes to tuples of str (immutable, shared by all callers)
         if "x_cols" in obj:
-            obj["x_cols"] = [str(x) for x in obj["x_cols"]]
+            obj["x_cols"] = tuple(str(x) for x in obj["x_cols"])
+            obj["x_cols_label_ids"] = feature_label_ids(obj["x_cols"])
         if "classes" in obj:
-            obj["classes"] = [str(c) for c in obj["classes"]]
+            obj["classes"] = tuple(str(c) for c in obj["classes"])
+        obj["_normalized"] = True
         return obj
 
     # Raw estimator: create a minimal bundle
     est = obj
+    _warm_up(est)
+    x_cols = tuple(f"vol_{i}" for i in range(1, 139))  # default 138 features
     return {
         "model": est,
-        "x_cols": [f"vol_{i}" for i in range(1, 139)],  # default 138 features
-        "classes": ["CN", "AD"],  # default 2-class
+        "x_cols": x_cols,
+        "x_cols_label_ids": feature_label_ids(x_cols),
+        "classes": ("CN", "AD"),  # default 2-class
+        "_normalized": True,
     }
+
+def _warm_up(est: Any) -> None:
+    """Best-effort dummy predict so mapped weights are faulted in before the first request."""
+    n = getattr(est, "n_features_in_", None)
+    if not isinstance(n, (int, np.integer)) or not hasattr(est, "predict"):
+        return
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            est.predict(np.zeros((1, int(n))))
+    except Exception:
+        pass
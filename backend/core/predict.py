@@ -1,13 +1,16 @@
 # core/predict.py
 from __future__ import annotations
-from typing import Dict, Any, List, Tuple, Optional
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, Any, List, Sequence, Optional
 
 import numpy as np
-import pandas as pd
-import nibabel as nib
-from sklearn.base import ClassifierMixin
 
-from .features import extract_roi_features
+if TYPE_CHECKING:  # annotations only; keep nibabel/sklearn off the import path
+    import nibabel as nib
+    from sklearn.base import ClassifierMixin
+
+from .features import extract_roi_features, feature_label_ids, feature_perm, gather_features
 
 def _feature_name_to_label_id(name: str) -> int | None:
     if name.startswith("vol_"):
@@ -17,26 +20,102 @@ def _feature_name_to_label_id(name: str) -> int | None:
             return None
     return None
 
-def _align_importances(importances: np.ndarray, x_cols: List[str]) -> Optional[np.ndarray]:
-    """Return importances if it matches x_cols length; else None."""
+def _align_importances(importances: np.ndarray, x_cols: Sequence[str]) -> Optional[np.ndarray]:
+    """Return importances (contiguous 1-D float64; a view when already so) if it matches x_cols length; else None."""
     try:
-        imp = np.asarray(importances).ravel()
+        imp = np.ascontiguousarray(importances, dtype=np.float64).reshape(-1)
         return imp if imp.shape[0] == len(x_cols) else None
     except Exception:
         return None
 
+# per-thread feature matrix reused across requests (handlers run on app.POOL threads)
+_scratch = threading.local()
+
+def _scratch_rows(n_rows: int, n_cols: int) -> np.ndarray:
+    """(n_rows, n_cols) float64 view into this thread's scratch buffer; grown on demand, never zeroed."""
+    buf = getattr(_scratch, "x", None)
+    if buf is None or buf.shape[1] != n_cols or buf.shape[0] < n_rows:
+        buf = np.empty((max(n_rows, 1), n_cols), dtype=np.float64)
+        _scratch.x = buf
+    return buf[:n_rows]
+
+def _bundle_perm(bundle: Dict[str, Any], x_cols: Sequence[str], label_ids: np.ndarray) -> np.ndarray:
+    """x_cols -> LUT-ordered volume positions; built once per (bundle, LUT label set) and kept on the bundle."""
+    key = label_ids.tobytes()
+    cached = bundle.get("_perm")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    col_ids = bundle.get("x_cols_label_ids")
+    if col_ids is None:
+        col_ids = feature_label_ids(x_cols)
+    perm = feature_perm(col_ids, label_ids)
+    bundle["_perm"] = (key, perm)
+    return perm
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k largest scores, best first; equal scores keep their original
+    order (same result as a stable descending sort, but O(n) selection + sort of k).
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.intp)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    kth = np.partition(scores, n - k)[n - k]  # k-th largest value
+    above = np.flatnonzero(scores > kth)
+    ties = np.flatnonzero(scores == kth)[:k - above.shape[0]]
+    idx = np.concatenate([above, ties])
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def _rank_by_volume(vols, icv, k):
+    """
+    Top-k of vols / (icv + 1e-9), best first, ties in index order.
+    Keeps a sorted buffer of k entries (insertion per candidate); returns (idx, scores).
+    """
+    n = vols.shape[0]
+    k = max(min(k, n), 0)
+    idx = np.empty(k, dtype=np.int64)
+    sc = np.empty(k, dtype=np.float64)
+    m = 0
+    denom = icv + 1e-9
+    for i in range(n):
+        s = vols[i] / denom
+        if m < k:
+            pos = m
+            m += 1
+        elif k > 0 and s > sc[k-1]:
+            pos = k - 1  # evict the current worst
+        else:
+            continue
+        while pos > 0 and s > sc[pos-1]:
+            sc[pos] = sc[pos-1]
+            idx[pos] = idx[pos-1]
+            pos -= 1
+        sc[pos] = s
+        idx[pos] = i
+    return idx[:m], sc[:m]
+
+@lru_cache(maxsize=1)
+def _rank_kernel():
+    """_rank_by_volume compiled with numba (imported on first use), or None without numba."""
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+    return njit(cache=True)(_rank_by_volume)
+
 def _top_regions_from_importance(
     importances: np.ndarray,
-    x_cols: List[str],
+    x_cols: Sequence[str],
     lut: Dict[int, str],
     k: int = 10,
 ) -> List[Dict[str, Any]]:
-    pairs: List[Tuple[str, float, int | None]] = []
-    for imp, col in zip(importances, x_cols):
-        pairs.append((col, float(imp), _feature_name_to_label_id(col)))
-    pairs.sort(key=lambda t: abs(t[1]), reverse=True)
+    imp = np.ascontiguousarray(importances, dtype=np.float64)
     out: List[Dict[str, Any]] = []
-    for col, score, lid in pairs[:k]:
+    for i in _top_k_indices(np.abs(imp), k):
+        col, score = x_cols[i], imp[i]
+        lid = _feature_name_to_label_id(col)
         out.append({
             "label_id": lid,
             "label_name": lut.get(lid, col) if lid is not None else col,
@@ -46,21 +125,23 @@ def _top_regions_from_importance(
 
 def _fallback_top_regions_by_volume(
     lut: Dict[int, str],
-    col_to_val: Dict[str, float],
+    label_ids: np.ndarray,
+    vols: np.ndarray,
     icv: float,
     k: int = 10,
 ) -> List[Dict[str, Any]]:
-    # Rank by normalized volume
-    items: List[Tuple[int, float]] = []
-    for col, v in col_to_val.items():
-        lid = _feature_name_to_label_id(col)
-        if lid is None:
-            continue
-        score = float(v) / (float(icv) + 1e-9)
-        items.append((lid, score))
-    items.sort(key=lambda t: t[1], reverse=True)
+    # Rank by normalized volume (label_ids/vols are parallel arrays)
+    vols = np.ascontiguousarray(vols, dtype=np.float64)
+    rank = _rank_kernel()
+    if rank is not None:
+        order, scores = rank(vols, float(icv), k)
+    else:
+        scores = vols / (float(icv) + 1e-9)
+        order = _top_k_indices(scores, k)
+        scores = scores[order]
     top = []
-    for lid, score in items[:k]:
+    for i, score in zip(order, scores):
+        lid = int(label_ids[i])
         top.append({
             "label_id": lid,
             "label_name": lut.get(lid, f"vol_{lid}"),
@@ -68,64 +149,106 @@ def _fallback_top_regions_by_volume(
         })
     return top
 
+def warm_up_kernels() -> None:
+    """Compile (or load from numba's disk cache) the brain-path kernels at bootstrap, not on the first request."""
+    gather_features(np.zeros(1), np.zeros(1, dtype=np.int64), np.empty(1))
+    rank = _rank_kernel()
+    if rank is not None:
+        rank(np.zeros(1), 1.0, 1)
+
 def predict(
     bundle: Dict[str, Any],
     seg_img: nib.Nifti1Image,
     lut: Dict[int, str],
     produce_xai: bool = False,
     class_name_map: Optional[Dict[str, str]] = None,  # NEW
+    include_proba: bool = True,
+    include_top_regions: bool = True,
 ) -> Dict[str, Any]:
     """
-    bundle: {"model": estimator, "x_cols": [...], "classes": [...]}
+    bundle: {"model": estimator, "x_cols": [...], "classes": [...]} as returned by load_model_bundle
     seg_img: MALPEM segmentation (labels 1..138)
     lut: {label_id: label_name}
     class_name_map: maps raw estimator labels to friendly e.g. {"0":"CN","1":"AD"}
+    include_proba: False -> "proba" only holds the predicted class (skips the per-class map)
+    include_top_regions: False (without XAI) -> "top_regions" is [] (skips the volume ranking)
     """
+    return predict_batch(bundle, [seg_img], lut, produce_xai, class_name_map,
+                         include_proba, include_top_regions)[0]
+
+def predict_batch(
+    bundle: Dict[str, Any],
+    seg_imgs: List[nib.Nifti1Image],
+    lut: Dict[int, str],
+    produce_xai: bool = False,
+    class_name_map: Optional[Dict[str, str]] = None,
+    include_proba: bool = True,
+    include_top_regions: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Same as predict() for several segmentations: features go into one (N, n_features)
+    matrix and the model is called once. Returns one result dict per image, in order.
+    """
+    if not seg_imgs:
+        return []
     model: ClassifierMixin = bundle["model"]
-    x_cols: List[str] = [str(c) for c in bundle["x_cols"]]
-    classes_bundle: List[str] = [str(c) for c in bundle["classes"]]
+    # load_model_bundle already normalized these (x_cols / classes tuple[str])
+    x_cols: Sequence[str] = bundle["x_cols"]
+    classes_bundle: Sequence[str] = bundle["classes"]
 
     # Features
-    feats_arr, icv = extract_roi_features(seg_img, lut, return_type="array")
-    label_ids = sorted(lut.keys())
-    col_to_val: Dict[str, float] = {f"vol_{lid}": float(v) for lid, v in zip(label_ids, feats_arr.tolist())}
-    x_row = [float(col_to_val.get(col, 0.0)) for col in x_cols]
-    X = pd.DataFrame([x_row], columns=x_cols)
+    label_ids = np.array(sorted(lut.keys()), dtype=np.int64)
+    # fixed x_cols <- volume permutation; non-volume columns and x_cols labels
+    # missing from the LUT read as 0.0
+    perm = _bundle_perm(bundle, x_cols, label_ids)
+    X = _scratch_rows(len(seg_imgs), len(x_cols))  # every row is fully overwritten below
+    feats: List[np.ndarray] = []
+    icvs: List[float] = []
+    for i, seg_img in enumerate(seg_imgs):
+        feats_arr, icv = extract_roi_features(seg_img, lut, return_type="array")
+        gather_features(feats_arr, perm, X[i])
+        feats.append(feats_arr)
+        icvs.append(icv)
+    X_in = X
+    if hasattr(model, "feature_names_in_"):
+        # fitted on a DataFrame: sklearn validates column names, keep them
+        import pandas as pd  # only these models need it; kept off the import path
+        X_in = pd.DataFrame(X, columns=x_cols)
+
+    # Friendly label mapping: one translation table (explicit map wins over the 0/1 fallback)
+    name_lut: Dict[str, str] = dict(class_name_map or {})
+    if set(classes_bundle) & {"CN", "AD"}:
+        name_lut.setdefault("0", "CN")
+        name_lut.setdefault("1", "AD")
 
-    # Predict
-    raw_pred_label: str
-    proba: Dict[str, float]
+    # Predict (labels / proba keys come out already mapped)
+    pred_labels: List[str]
+    probas: List[Dict[str, float]]
 
     if hasattr(model, "predict_proba"):
-        proba_vec = model.predict_proba(X)[0]
-        est_classes = getattr(model, "classes_", np.array(classes_bundle, dtype=object))
-        # map to strings
-        est_classes = np.array([str(c) for c in est_classes], dtype=object)
-        raw_pred_label = str(est_classes[int(np.argmax(proba_vec))])
-        proba = {str(c): float(p) for c, p in zip(est_classes, proba_vec)}
+        proba_mat = model.predict_proba(X_in)
+        est_classes = getattr(model, "classes_", classes_bundle)
+        # map to strings, then to friendly names, once per call
+        mapped_classes = [name_lut.get(s, s) for s in (str(c) for c in est_classes)]
+        best = np.argmax(proba_mat, axis=1)
+        pred_labels = [mapped_classes[b] for b in best]
+        if include_proba:
+            probas = [dict(zip(mapped_classes, row)) for row in proba_mat.tolist()]
+        else:
+            probas = [{lbl: float(row[b])} for lbl, row, b in zip(pred_labels, proba_mat, best)]
     else:
-        yhat = model.predict(X)[0]
-        raw_pred_label = str(yhat)
+        raw_labels = [str(y) for y in model.predict(X_in)]
+        pred_labels = [name_lut.get(lbl, lbl) for lbl in raw_labels]
         # fabricate proba 1/0
-        proba = {c: (1.0 if str(c) == raw_pred_label else 0.0) for c in classes_bundle}
-
-    # Friendly label mapping
-    def map_name(s: str) -> str:
-        if class_name_map and s in class_name_map:
-            return class_name_map[s]
-        # fallbacks
-        if s in {"0", "1"} and set(classes_bundle) & {"CN", "AD"}:
-            return "CN" if s == "0" else "AD"
-        return s
-
-    pred_label = map_name(raw_pred_label)
-    proba = {map_name(k): v for k, v in proba.items()}
-
-    # XAI
-    top_regions: List[Dict[str, Any]] = []
-    xai_payload = None
+        if include_proba:
+            probas = [{name_lut.get(str(c), str(c)): (1.0 if str(c) == lbl else 0.0) for c in classes_bundle}
+                      for lbl in raw_labels]
+        else:
+            probas = [{lbl: 1.0} for lbl in pred_labels]
+
+    # XAI: model-level importances are the same for every image
+    importances = None
     if produce_xai:
-        importances = None
         if hasattr(model, "feature_importances_"):
             importances = _align_importances(np.asarray(model.feature_importances_), x_cols)
         elif hasattr(model, "coef_"):
@@ -134,24 +257,31 @@ def predict(
                 importances = _align_importances(np.mean(np.abs(coef), axis=0), x_cols)
             else:
                 importances = _align_importances(np.abs(coef).ravel(), x_cols)
+    imp_regions = _top_regions_from_importance(importances, x_cols, lut, k=10) if importances is not None else None
 
-        if importances is not None:
-            top_regions = _top_regions_from_importance(importances, x_cols, lut, k=10)
+    results: List[Dict[str, Any]] = []
+    for pred_label, proba, feats_arr, icv in zip(pred_labels, probas, feats, icvs):
+        top_regions: List[Dict[str, Any]]
+        xai_payload = None
+        if produce_xai and imp_regions is not None:
+            top_regions = [dict(r) for r in imp_regions]
             xai_payload = {"method": "feature_importance", "top_regions": top_regions}
-        else:
+        elif produce_xai:
             # robust fallback: rank by normalized volume
-            top_regions = _fallback_top_regions_by_volume(lut, col_to_val, icv, k=10)
+            top_regions = _fallback_top_regions_by_volume(lut, label_ids, feats_arr, icv, k=10)
             xai_payload = {"method": "normalized_volume_fallback", "top_regions": top_regions}
-    else:
-        # still give useful top regions (volume-based) if caller didn’t request XAI
-        top_regions = _fallback_top_regions_by_volume(lut, col_to_val, icv, k=10)
-        xai_payload = None
+        elif include_top_regions:
+            # still give useful top regions (volume-based) if caller didn’t request XAI
+            top_regions = _fallback_top_regions_by_volume(lut, label_ids, feats_arr, icv, k=10)
+        else:
+            top_regions = []
 
-    return {
-        "prediction": pred_label,
-        "proba": proba,
-        "icv_mm3": float(icv),
-        "used_features": x_cols,
-        "top_regions": top_regions,
-        "xai": xai_payload,
-    }
+        results.append({
+            "prediction": pred_label,
+            "proba": proba,
+            "icv_mm3": float(icv),
+            "used_features": list(x_cols),  # fresh list: x_cols belongs to the cached bundle
+            "top_regions": top_regions,
+            "xai": xai_payload,
+        })
+    return results
@@ -1,15 +1,34 @@
 import os, io, json, zipfile, tempfile
 from typing import Optional
+import numpy as np
 import nibabel as nib
 
+from core.io_utils import load_nii_fileobj
+
+try:  # optional: C serializer, handles numpy scalars/arrays natively
+    import orjson
+except ImportError:
+    orjson = None
+
+def _nii_from_fileobj(fileobj):
+    """Load single-file NIfTI from a seekable binary stream; None if the header is not recognized."""
+    try:
+        return load_nii_fileobj(fileobj)
+    except nib.filebasedimages.ImageFileError:
+        return None
+
 def nii_from_bytes_or_path(data: bytes=None, path: Optional[str]=None):
     """
-    Robustly load NIfTI from bytes or path. Writes to temp if needed.
+    Robustly load NIfTI from bytes or path. Bytes are decoded in memory;
+    a temp file is only used when the header cannot be sniffed.
     """
     if path:
         return nib.load(path)
     if data is None:
         raise ValueError("No data/path for NIfTI")
+    img = _nii_from_fileobj(io.BytesIO(data))
+    if img is not None:
+        return img
     # Write to a temp .nii.gz to ensure nibabel works on all platforms
     with tempfile.NamedTemporaryFile(suffix=".nii.gz", delete=False) as f:
         f.write(data)
@@ -22,16 +41,29 @@ def nii_from_bytes_or_path(data: bytes=None, path: Optional[str]=None):
     return img
 
 def read_nii_from_zip_member(zip_path: str, member: str):
+    # Stream the member into nibabel instead of reading it into bytes first;
+    # voxels are decoded once, straight into the array, while the zip is open.
     with zipfile.ZipFile(zip_path) as zf:
         with zf.open(member) as fh:
-            data = fh.read()
-    return nii_from_bytes_or_path(data=data)
+            img = _nii_from_fileobj(fh)
+            if img is None:
+                fh.seek(0)
+                return nii_from_bytes_or_path(data=fh.read())
+            return img.__class__(np.asanyarray(img.dataobj), img.affine, img.header)
 
 def json_dump(path: str, obj):
     os.makedirs(os.path.dirname(path), exist_ok=True)
+    if orjson is not None:
+        opts = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=opts))
+        return
     with open(path, "w", encoding="utf-8") as f:
         json.dump(obj, f, indent=2)
 
 def json_load(path: str):
+    if orjson is not None:
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)